@@ -1,56 +1,113 @@
 # -----------------------------------------------------------------------------
 # Import stuff
 import numpy as np
+import multiprocessing
 
 from astropy import wcs
-from itertools import combinations
-from pnicer.utils.kde import mp_kde
+from functools import reduce, lru_cache
+from itertools import combinations, repeat
+from scipy.spatial import cKDTree
+from pnicer.utils.kde import mp_kde, fft_kde
 from pnicer.utils.wcs import data2grid
 from pnicer.utils.auxiliary import flatten_lol
 from pnicer.utils.gmm import mp_gmm, gmm_scale, gmm_expected_value, gmm_population_variance
 from pnicer.utils.plots import caxes, caxes_delete_ticklabels, finalize_plot
-from pnicer.utils.algebra import round_partial, centroid_sphere, distance_sky
+from pnicer.utils.algebra import round_partial, centroid_sphere, distance_sky, partition_percentiles
 
-# noinspection PyPackageRequirements
-from sklearn.neighbors import NearestNeighbors
 # noinspection PyPackageRequirements
 from sklearn.mixture import GaussianMixture
 
 
+# -----------------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def _feature_combinations(n_features, idxstart):
+    """
+    Index tuples of all feature combinations with at least 'idxstart' features.
+
+    Parameters
+    ----------
+    n_features : int
+        Number of features.
+    idxstart : int
+        Minimum number of features in a combination.
+
+    Returns
+    -------
+    tuple
+
+    """
+
+    return tuple(c for p in range(idxstart, n_features + 1) for c in combinations(range(n_features), p))
+
+
+# -----------------------------------------------------------------------------
+def _index_selection(idx):
+    """
+    Converts feature indices to a slice if they are evenly spaced (so that numpy returns a view instead of a copy).
+
+    Parameters
+    ----------
+    idx : tuple
+        Increasing feature indices.
+
+    Returns
+    -------
+    slice, list
+
+    """
+
+    step = idx[1] - idx[0] if len(idx) > 1 else 1
+    if (step > 0) & all(b - a == step for a, b in zip(idx[:-1], idx[1:])):
+        return slice(idx[0], idx[-1] + 1, step)
+    return list(idx)
+
+
 # ----------------------------------------------------------------------------- #
 # ----------------------------------------------------------------------------- #
 # noinspection PyProtectedMember
 class Features:
 
     # -----------------------------------------------------------------------------
-    def __init__(self, features, feature_err, feature_extvec, feature_names=None, feature_coordinates=None):
+    def __init__(self, features, feature_err, feature_extvec, feature_names=None, feature_coordinates=None,
+                 dtype=np.float32):
         """
         Basic Data class which provides the foundation for extinction measurements.
 
         Parameters
         ----------
         features : iterable
-            List of feature arrays. All arrays must have the same length!
+            List of feature arrays (or 2D array with shape (n_features, n_data)). All arrays must have the same length!
         feature_err : iterable
-            List off feature error arrays.
+            List off feature error arrays (or 2D array with shape (n_features, n_data)).
         feature_extvec : iterable
             List holding the extinction components for each feature (extinction vector).
         feature_coordinates : astropy.coordinates.SkyCoord, optional
             Astropy SkyCoord instance.
         feature_names : list
             List of feature names.
+        dtype : np.dtype, optional
+            Data type in which features and errors are stored. Default is np.float32. Rotated feature spaces are always
+            kept in np.float64.
 
         """
 
-        # Set features
-        self.features = features
-        self.features_err = feature_err
+        # Input data must have the same size
+        if len(set([np.size(x) for x in features])) > 1:
+            raise ValueError("Input arrays must have equal size")
+
+        # Set features as contiguous (n_features, n_data) arrays of the requested data type
+        self.dtype = np.dtype(dtype)
+        self.features = np.ascontiguousarray(features, dtype=self.dtype)
+        self.features_err = np.ascontiguousarray(feature_err, dtype=self.dtype)
         self.features_names = feature_names
         self.extvec = ExtinctionVector(extvec=feature_extvec)
 
         # Set coordinate attributes
         self.coordinates = feature_coordinates
 
+        # Lazily evaluated attributes
+        self.__features_masks, self.__strict_mask, self.__plotrange_features = None, None, None
+
         # Generate simple names for the magnitudes if not set
         if self.features_names is None:
             self.features_names = ["Mag" + str(idx + 1) for idx in range(self.n_features)]
@@ -76,10 +133,6 @@ class Features:
         if len(set([len(l) for l in [self.features, self.features_err, self.features_names]])) != 1:
             raise ValueError("Input lists must have equal length")
 
-        # Input data must also have the same size
-        if len(set([x.size for x in self.features])) != 1:
-            raise ValueError("Input arrays must have equal size")
-
         # Coordinates must be supplied for all data if set
         if feature_coordinates is not None:
             if len(self.coordinates) != len(self.features[0]):
@@ -152,7 +205,8 @@ class Features:
     @property
     def _features_masks(self):
         """
-        Provides a list with masks for each given feature. True (1) entries are good, False (0) are bad.
+        Provides a list with masks for each given feature. True (1) entries are good, False (0) are bad. The masks are
+        evaluated only once for each instance.
 
 
         Returns
@@ -162,7 +216,16 @@ class Features:
 
         """
 
-        return [np.isfinite(m) & np.isfinite(e) for m, e in zip(self.features, self.features_err)]
+        if self.__features_masks is None:
+            self.__features_masks = []
+            for m, e in zip(self.features, self.features_err):
+
+                # Combine finite masks in place to save one temporary per feature
+                mask = np.isfinite(m)
+                np.logical_and(mask, np.isfinite(e), out=mask)
+                self.__features_masks.append(mask)
+
+        return self.__features_masks
 
     # -----------------------------------------------------------------------------
     def _loose_mask(self, max_bad_features):
@@ -188,7 +251,8 @@ class Features:
     @property
     def _strict_mask(self):
         """
-        Combines all feature masks into a single mask. Any entry that has a NaN in any band will be masked.
+        Combines all feature masks into a single mask. Any entry that has a NaN in any band will be masked. The mask
+        is evaluated only once for each instance.
 
         Returns
         -------
@@ -197,7 +261,10 @@ class Features:
 
         """
 
-        return np.prod(np.vstack(self._features_masks), axis=0, dtype=bool)
+        if self.__strict_mask is None:
+            self.__strict_mask = reduce(np.logical_and, self._features_masks)
+
+        return self.__strict_mask
 
         # Would be the same:
         # return self._loose_mask(max_bad_features=0)
@@ -236,7 +303,7 @@ class Features:
             idx = [self.features_names.index(key) for key in names]
 
         # Return combined mask
-        return np.prod(np.vstack([self._features_masks[i] for i in idx]), axis=0, dtype=bool)
+        return reduce(np.logical_and, [self._features_masks[i] for i in idx])
 
     # -----------------------------------------------------------------------------
     @staticmethod
@@ -343,13 +410,21 @@ class Features:
         """
 
         # Round data to requested precision.
-        grid_data = round_partial(data=data, precision=precision).T
+        grid_data = round_partial(data=data, precision=precision)
+
+        # Sort positions lexicographically
+        grid_data = grid_data[:, np.lexsort(grid_data)]
 
-        # Get unique positions for coordinates
-        dummy = np.ascontiguousarray(grid_data).view(np.dtype((np.void, grid_data.dtype.itemsize * grid_data.shape[1])))
-        _, idx = np.unique(dummy, return_index=True)
+        # Nothing to do for an empty grid
+        if grid_data.shape[1] == 0:
+            return grid_data
 
-        return grid_data[np.sort(idx)].T
+        # Unique positions are those that differ from their predecessor in any dimension
+        unique = np.empty(grid_data.shape[1], dtype=bool)
+        unique[0] = True
+        unique[1:] = np.any(grid_data[:, 1:] != grid_data[:, :-1], axis=0)
+
+        return grid_data[:, unique]
 
     # -----------------------------------------------------------------------------
     @classmethod
@@ -388,27 +463,69 @@ class Features:
 
         """
 
-        # Apply strict masks (no NaN can be present!)
-        data = np.vstack(self.features).T[self._strict_mask].T
-        err = np.vstack(self.features_err).T[self._strict_mask].T
+        # Get strict mask (no NaN can be present!)
+        mask = self._strict_mask
+
+        # Apply mask
+        data, err = self.features[:, mask], self.features_err[:, mask]
 
-        # Rotate data
-        rotdata = self.extvec._rotmatrix.dot(data)
+        # Rotate data (in double precision since the grid and the models are built in the rotated space)
+        rotdata = self.extvec._rotmatrix @ data
 
         # Rotate extinction vector
         extvec = self.extvec._extvec_rot
 
         # In case no coordinates are supplied they need to be masked
         if self.coordinates is not None:
-            coordinates = self.coordinates[self._strict_mask]
+            coordinates = self.coordinates[mask]
         else:
             coordinates = None
 
-        # Return
+        # Return (the rotated data are passed on without copying)
         # noinspection PyTypeChecker
-        return self.__class__([rotdata[idx, :] for idx in range(self.n_features)],
-                              [err[idx, :]for idx in range(self.n_features)],
-                              extvec, coordinates, [x + "_rot" for x in self.features_names])
+        return self.__class__(rotdata, err, extvec, coordinates, [x + "_rot" for x in self.features_names],
+                              dtype=np.float64)
+
+    # -----------------------------------------------------------------------------
+    def _subset(self, idx):
+        """
+        Creates a new instance holding only a subset of the features. The normal constructor (and its input checks) is
+        bypassed and already evaluated per-feature masks and plot ranges are transferred to the new instance.
+
+        Parameters
+        ----------
+        idx : iterable
+            Indices of the features to keep.
+
+        Returns
+        -------
+            New instance with the selected features.
+
+        """
+
+        # Create empty instance of the same class
+        new = self.__class__.__new__(self.__class__)
+
+        # Set features (as views into the parent arrays when the indices are evenly spaced)
+        sel = _index_selection(idx=tuple(idx))
+        new.dtype = self.dtype
+        new.features, new.features_err = self.features[sel], self.features_err[sel]
+        new.features_names = [self.features_names[i] for i in idx]
+        new.extvec = ExtinctionVector(extvec=[self.extvec.extvec[i] for i in idx])
+        new.coordinates = self.coordinates
+
+        # Transfer lazily evaluated attributes if they are already available
+        new.__features_masks = [self.__features_masks[i] for i in idx] if self.__features_masks is not None else None
+        new.__plotrange_features = [self.__plotrange_features[i] for i in idx] \
+            if self.__plotrange_features is not None else None
+        new.__strict_mask = None
+
+        # Add data dictionary
+        new.dict = {}
+        for f, e, n in zip(new.features, new.features_err, new.features_names):
+            new.dict[n], new.dict[n + "_err"] = f, e
+
+        return new
 
     # -----------------------------------------------------------------------------
     def _all_combinations(self, idxstart):
@@ -427,28 +544,8 @@ class Features:
 
         """
 
-        all_c = [item for sublist in [combinations(range(self.n_features), p)
-                                      for p in range(idxstart, self.n_features + 1)]
-                 for item in sublist]
-
-        # Import
-        from pnicer.user import ApparentColors, ApparentMagnitudes
-
-        combination_instances = []
-        for c in all_c:
-            cdata, cerror = [self.features[idx] for idx in c], [self.features_err[idx] for idx in c]
-            cnames = [self.features_names[idx] for idx in c]
-            extvec = [self.extvec.extvec[idx] for idx in c]
-
-            if isinstance(self, ApparentMagnitudes):
-                combination_instances.append(self.__class__(magnitudes=cdata, errors=cerror, extvec=extvec,
-                                                            coordinates=self.coordinates, names=cnames))
-            elif isinstance(self, ApparentColors):
-                combination_instances.append(self.__class__(colors=cdata, errors=cerror, extvec=extvec,
-                                                            coordinates=self.coordinates, names=cnames))
-
         # Return list of combinations.
-        return combination_instances
+        return [self._subset(idx=c) for c in _feature_combinations(n_features=self.n_features, idxstart=idxstart)]
 
     # ----------------------------------------------------------------------------- #
     #                       Coordinate methods and attributes                       #
@@ -525,7 +622,8 @@ class Features:
     @property
     def _plotrange_features(self):
         """
-        Convenience property to calculate a plot range for all provided features.
+        Convenience property to calculate a plot range for all provided features. The ranges are evaluated only once
+        for each instance.
 
         Returns
         -------
@@ -534,8 +632,15 @@ class Features:
 
         """
 
-        return [(np.floor(np.percentile(x[m], 0.01)), np.ceil(np.percentile(x[m], 99.99)))
-                for x, m in zip(self.features, self._features_masks)]
+        if self.__plotrange_features is None:
+
+            # Apply the mask only once for both percentiles
+            self.__plotrange_features = []
+            for x, m in zip(self.features, self._features_masks):
+                pmin, pmax = partition_percentiles(data=x[m], percentiles=[0.01, 99.99])
+                self.__plotrange_features.append((np.floor(pmin), np.ceil(pmax)))
+
+        return self.__plotrange_features
 
     # -----------------------------------------------------------------------------
     @property
@@ -692,14 +797,15 @@ class Features:
         # Get figure and axes
         fig, axes = caxes(ndim=self.n_features, ax_size=self._get_plot_axsize(size=ax_size), labels=self.features_names)
 
+        # We need a square grid!
+        lows, highs = zip(*self._plotrange_features)
+        l, h = min(lows), max(highs)
+
         # Get 2D combination indices
         for idx, ax in zip(combinations(range(self.n_features), 2), axes):
 
             ax.scatter(self.features[idx[1]][::skip], self.features[idx[0]][::skip], lw=0, s=5, alpha=0.1, **kwargs)
 
-            # We need a square grid!
-            l, h = np.min([x[0] for x in self._plotrange_features]), np.max([x[1] for x in self._plotrange_features])
-
             # Ranges
             ax.set_xlim(l, h)
             ax.set_ylim(l, h)
@@ -737,25 +843,24 @@ class Features:
         fig, axes = caxes(ndim=self.n_features, ax_size=self._get_plot_axsize(size=ax_size),
                           labels=self.features_names)
 
+        # We need a square grid (identical for all combinations)!
+        lows, highs = zip(*self._plotrange_features)
+        l, h = min(lows), max(highs)
+        grid_axis = np.arange(start=l, stop=h, step=grid_bw)
+
         # Get 2D combination indices
         for idx, ax in zip(combinations(range(self.n_features), 2), axes):
 
             # Get clean data from the current combination
-            mask = np.prod(np.vstack([self._features_masks[idx[0]], self._features_masks[idx[1]]]), axis=0, dtype=bool)
+            mask = self._features_masks[idx[0]] & self._features_masks[idx[1]]
 
-            # We need a square grid!
-            l, h = np.min([x[0] for x in self._plotrange_features]), np.max([x[1] for x in self._plotrange_features])
-
-            x, y = np.meshgrid(np.arange(start=l, stop=h, step=grid_bw), np.arange(start=l, stop=h, step=grid_bw))
-
-            # Get kernel density
+            # Get kernel density on the regular grid
             data = np.vstack([self.features[idx[0]][mask], self.features[idx[1]][mask]]).T
-            xgrid = np.vstack([x.ravel(), y.ravel()]).T
-            dens = mp_kde(grid=xgrid, data=data, bandwidth=grid_bw * 2, kernel=kernel, absolute=True,
-                          sampling=2).reshape(x.shape)
+            dens = fft_kde(data=data, axes=[grid_axis, grid_axis], bandwidth=grid_bw * 2, kernel=kernel,
+                           absolute=True, sampling=2)
 
             # Plot result
-            ax.imshow(dens.T, origin="lower", interpolation="nearest", extent=[l, h, l, h], cmap=cmap)
+            ax.imshow(dens, origin="lower", interpolation="nearest", extent=[l, h, l, h], cmap=cmap)
 
         # Modify tick labels
         caxes_delete_ticklabels(axes=axes, xfirst=False, xlast=True, yfirst=False, ylast=True)
@@ -787,15 +892,18 @@ class Features:
         # Get plot limits
         lim = wcs.WCS(header=header).wcs_world2pix(self._plotrange_world[0], self._plotrange_world[1], 0)
 
+        # Get coordinates only once
+        lon, lat = self._lon_deg, self._lat_deg
+
         # Loop over features and plot
         for idx in range(self.n_features):
 
             # Grab axes
             ax = axes[idx]
 
-            ax.scatter(self._lon_deg[self._features_masks[idx]][::skip],
-                       self._lat_deg[self._features_masks[idx]][::skip],
-                       transform=ax.get_transform(self._frame_name), **kwargs)
+            # Only index the retained sources
+            sidx = np.flatnonzero(self._features_masks[idx])[::skip]
+            ax.scatter(lon[sidx], lat[sidx], transform=ax.get_transform(self._frame_name), **kwargs)
 
             # Set axes limits
             ax.set_xlim(lim[0])
@@ -829,16 +937,21 @@ class Features:
         # Get figure, axes, and wcs grid
         fig, axes, grid_world, header = self._gridspec_world(pixsize=bandwidth / 2, ax_size=ax_size, proj_code="TAN")
 
+        # Build evaluation grid once for all features
+        xgrid = np.column_stack([grid_world[0].ravel(), grid_world[1].ravel()])
+
+        # Get coordinates only once
+        lon, lat = self._lon_deg, self._lat_deg
+
         # To avoid editor warning
         scale = 1
 
         # Loop over features and plot
         for idx in range(self.n_features):
 
-            # Get density
-            xgrid = np.vstack([grid_world[0].ravel(), grid_world[1].ravel()]).T
-            data = np.vstack([self._lon_deg[self._features_masks[idx]][::skip],
-                              self._lat_deg[self._features_masks[idx]][::skip]]).T
+            # Get density (only index the retained sources)
+            sidx = np.flatnonzero(self._features_masks[idx])[::skip]
+            data = np.column_stack([lon[sidx], lat[sidx]])
             dens = mp_kde(grid=xgrid, data=data, bandwidth=bandwidth, kernel=kernel,
                           norm=None).reshape(grid_world[0].shape)
 
@@ -949,7 +1062,7 @@ class Features:
         return [gmm], var_all, idx_all, zp_all
 
     # -----------------------------------------------------------------------------
-    def _pnicer_multivariate(self, control, max_components, **kwargs):
+    def _pnicer_multivariate(self, control, max_components, parallel=True, **kwargs):
         """
         Mulitvariate PNICER implementation.
 
@@ -959,6 +1072,8 @@ class Features:
             Control Field Feature instance
         max_components : int
             Maximum number of GMM compponents to use.
+        parallel : bool, optional
+            Whether to fit the GMMs and query the grid with parallelisation. Default is True.
         kwargs
             Additional kwargs for GaussianMixture
 
@@ -980,35 +1095,39 @@ class Features:
         if control_rot.n_data == 0:
             return [None], var_all, idx_all, zp_all
 
-        # Get bandwidth from photometric errors
-        bandwidth = np.round(np.mean(np.nanmean(self.features_err, axis=1)), 2)
+        # Get bandwidth from photometric errors (reduce each feature separately to avoid stacking all errors)
+        bandwidth = np.round(np.mean([np.nanmean(e) for e in self.features_err]), 2)
 
         # Determine bin widths for grid according to bandwidth and sampling
         # TODO: Optimize sampling or make it user choice
         sampling = 2
-        bin_grid = np.float(bandwidth / sampling)
+        bin_grid = float(bandwidth / sampling)
 
         # Now we build a grid from the rotated data for all components but the first
-        grid_data = Features._build_feature_grid(data=np.vstack(science_rot.features)[1:, :], precision=bin_grid)
-
-        # Define NN algorithm
-        try:
-            nbrs = NearestNeighbors(n_neighbors=1, algorithm="auto").fit(grid_data.T)
+        grid_data = Features._build_feature_grid(data=science_rot.features[1:], precision=bin_grid)
 
         # Return if bad grid
-        except ValueError:
+        if grid_data.shape[-1] == 0:
             return [None], var_all, idx_all, zp_all
 
+        # Build KD-tree on the (low-dimensional) grid
+        tree = cKDTree(np.ascontiguousarray(grid_data.T), balanced_tree=False, compact_nodes=False)
+
+        # Threads for the tree queries (a single one when we already run in a worker process)
+        workers = -1 if parallel else 1
+
         # Assign each control field source the nearest neighbor grid point
-        dis, idx = nbrs.kneighbors(np.vstack(control_rot.features)[1:, :].T)
-        dis, idx = dis[:, 0], idx[:, 0]
+        dis, idx = tree.query(np.ascontiguousarray(control_rot.features[1:].T), k=1, workers=workers)
 
         # Filter too large distances (in case the NN is further than the grid bin width)
         # TODO: The smaller the sampling (here fixed at 2), the less data in a vector!
         idx[dis > bandwidth / 2] = grid_data.shape[-1] + 1
 
-        # Build data vectors for GMM-fits
-        vectors_data = [control_rot.features[0][idx == i].reshape(-1, 1) for i in range(grid_data.shape[-1])]
+        # Build data vectors for GMM-fits (group sources by grid point with a single sort instead of a mask per point)
+        n_grid = grid_data.shape[-1]
+        order = np.argsort(idx, kind="stable")
+        counts = np.bincount(idx, minlength=n_grid)[:n_grid]
+        vectors_data = [v.reshape(-1, 1) for v in np.split(control_rot.features[0][order], np.cumsum(counts))[:n_grid]]
 
         # Each control field vector needs to contain at least 20 sources
         vectors_data = [None if len(v) < 20 else v for v in vectors_data]
@@ -1018,7 +1137,8 @@ class Features:
             return [None], var_all, idx_all, zp_all
 
         # Fit GMM for each vector
-        vectors_gmm = mp_gmm(data=vectors_data, max_components=max_components, **self._set_defaults_gmm(**kwargs))
+        vectors_gmm = mp_gmm(data=vectors_data, max_components=max_components, parallel=parallel,
+                             **self._set_defaults_gmm(**kwargs))
 
         # Determine scaling and shifting factor for models
         scale = self.extvec._extinction_norm
@@ -1037,17 +1157,18 @@ class Features:
         grid_good_idx = [i for i, j in enumerate(vectors_gmm) if isinstance(j, GaussianMixture)]
         vectors_gmm = [vectors_gmm[i] for i in grid_good_idx]
         vectors_shift = [vectors_shift[i] for i in grid_good_idx]
+        vectors_var = [vectors_var[i] for i in grid_good_idx]
 
         # Return if no model converged
         if len(vectors_gmm) == 0:
             return [None], var_all, idx_all, zp_all
 
         # Find the nearest neighbor for each science target in the cleaned grid
-        nbrs = NearestNeighbors(n_neighbors=1, algorithm="ball_tree").fit(grid_data[:, grid_good_idx].T)
-        science_idx = nbrs.kneighbors(np.vstack(science_rot.features)[1:, :].T)[1][:, 0]
+        tree = cKDTree(np.ascontiguousarray(grid_data[:, grid_good_idx].T), balanced_tree=False, compact_nodes=False)
+        science_idx = tree.query(np.ascontiguousarray(science_rot.features[1:].T), k=1, workers=workers)[1]
 
         # Determine variance for each source
-        var = np.array([vectors_var[idx] for idx in science_idx])
+        var = np.array(vectors_var)[science_idx]
 
         # Fill and index, variance and zp arrays for all sources
         idx_all[self._strict_mask] = science_idx
@@ -1078,15 +1199,21 @@ class Features:
 
         """
 
-        # Loop over all combinations and run PNICER
-        gmm_combinations, var_combinations, uidx_combinations, zp_combinations, models_norm = [], [], [], [], []
-        for sc, cc in zip(combinations_science, combinations_control):
+        # Run PNICER for all combinations in parallel if there are enough of them to keep all cores busy...
+        n_cpu = multiprocessing.cpu_count()
+        if len(combinations_science) >= n_cpu > 1:
+            with multiprocessing.Pool(n_cpu) as pool:
+                mp = pool.starmap(_pnicer_single, zip(combinations_science, combinations_control,
+                                                      repeat(max_components), repeat(False), repeat(kwargs)))
 
-            # Choose uni/multivariate PNICER
-            if sc.n_features == 1:
-                g, v, i, zp = sc._pnicer_univariate(control=cc, max_components=max_components, **kwargs)
-            else:
-                g, v, i, zp = sc._pnicer_multivariate(control=cc, max_components=max_components, **kwargs)
+        # ...otherwise run them one after the other and parallelise the GMM fits within each combination
+        else:
+            mp = [_pnicer_single(science=sc, control=cc, max_components=max_components, parallel=True, kwargs=kwargs)
+                  for sc, cc in zip(combinations_science, combinations_control)]
+
+        # Loop over all combinations and collect results
+        gmm_combinations, var_combinations, uidx_combinations, zp_combinations, models_norm = [], [], [], [], []
+        for g, v, i, zp in mp:
 
             # Generate unique index for stacked GMM array
             uidx_combinations.append(i + len(flatten_lol(gmm_combinations)))
@@ -1103,35 +1230,26 @@ class Features:
         # Stack unique GMMs and norms
         gmm_unique = np.hstack(gmm_combinations)
 
-        # Choose minimum variance GMM across all combinations
-        minidx = np.argmin(np.array(var_combinations), axis=0)
+        # Choose minimum variance GMM across all combinations (non-finite variances never win)
+        var_combinations = np.array(var_combinations)
+        var_combinations[~np.isfinite(var_combinations)] = np.inf
+        minidx = np.argmin(var_combinations, axis=0)[np.newaxis]
 
         # Select model index
-        sources_index = np.array(uidx_combinations)[minidx, np.arange(self.n_data)]
-
-        # Create clean index of models
-        clean_index = list(set(sources_index))
-        clean_index.sort()
-        clean_index = list(filter(lambda a: a != -1, clean_index))
+        sources_index = np.take_along_axis(np.array(uidx_combinations), minidx, axis=0)[0]
 
-        # Create new index
-        new_index = [i for i in range(len(clean_index))]
-
-        # Get difference between indices
-        diff_index = [c - n for c, n in zip(clean_index, new_index)]
+        # Create clean index of models and rebase sources_index onto it
+        good = sources_index >= 0
+        clean_index, sources_index[good] = np.unique(sources_index[good], return_inverse=True)
 
         # Fetch and sort all clean unique models
         gmm_unique = list(gmm_unique[clean_index])
 
-        # Rebase sources_index
-        for c, d in zip(clean_index, diff_index):
-            sources_index[sources_index == c] = sources_index[sources_index == c] - d
-
         # Set all negative indices to bad value
-        sources_index[sources_index < 0] = sources_index.size + 1
+        sources_index[~good] = sources_index.size + 1
 
         # Get zero point for each source
-        sources_zp = np.array(zp_combinations)[minidx, np.arange(self.n_data)]
+        sources_zp = np.take_along_axis(np.array(zp_combinations), minidx, axis=0)[0]
         # TODO: Check what is happening to all-bad slices
 
         # Chech if all bad slices are also bad in the index
@@ -1166,6 +1284,39 @@ class Features:
         return [f - extinction * v for f, v in zip(self.features, self.extvec.extvec)]
 
 
+# -----------------------------------------------------------------------------
+# noinspection PyProtectedMember
+def _pnicer_single(science, control, max_components, parallel, kwargs):
+    """
+    Runs PNICER for a single combination of features. Helper routine for parallelisation over combinations.
+
+    Parameters
+    ----------
+    science
+        Science field Features instance.
+    control
+        Control field Features instance.
+    max_components : int
+        Maximum number of GMM compponents to use.
+    parallel : bool
+        Whether to parallelise within the combination (must be False when running in a worker process).
+    kwargs
+        Additional kwargs for GaussianMixture
+
+    Returns
+    -------
+        Fitted models, variance, model index, and zero-point for all sources.
+
+    """
+
+    # Choose uni/multivariate PNICER
+    if science.n_features == 1:
+        return science._pnicer_univariate(control=control, max_components=max_components, **kwargs)
+    else:
+        return science._pnicer_multivariate(control=control, max_components=max_components, parallel=parallel,
+                                            **kwargs)
+
+
 # ----------------------------------------------------------------------------- #
 # ----------------------------------------------------------------------------- #
 class ExtinctionVector:
@@ -1185,6 +1336,9 @@ class ExtinctionVector:
         # Set attributes
         self.extvec = extvec
 
+        # Lazily evaluated attributes
+        self.__rotmatrix, self.__extvec_rot = None, None
+
     # -----------------------------------------------------------------------------
     def __len__(self):
         return len(self.extvec)
@@ -1303,7 +1457,11 @@ class ExtinctionVector:
 
         """
 
-        return ExtinctionVector._get_rotmatrix(self.extvec)
+        # Calculate only once
+        if self.__rotmatrix is None:
+            self.__rotmatrix = ExtinctionVector._get_rotmatrix(self.extvec)
+
+        return self.__rotmatrix
 
     # -----------------------------------------------------------------------------
     @property
@@ -1331,7 +1489,11 @@ class ExtinctionVector:
 
         """
 
-        return self._rotmatrix.dot(self.extvec)
+        # Calculate only once
+        if self.__extvec_rot is None:
+            self.__extvec_rot = self._rotmatrix @ np.asarray(self.extvec)
+
+        return self.__extvec_rot
 
     # -----------------------------------------------------------------------------
     @property
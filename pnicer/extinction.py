@@ -9,6 +9,7 @@ from astropy import wcs
 from astropy.io import fits
 from itertools import repeat
 from astropy.table import Table
+from functools import partial
 from multiprocessing.pool import Pool
 # noinspection PyPackageRequirements
 from sklearn.neighbors import NearestNeighbors
@@ -19,6 +20,9 @@ from pnicer.utils.plots import finalize_plot
 from pnicer.utils.algebra import centroid_sphere, distance_sky, std2fwhm, round_partial
 from pnicer.extinction_map import DiscreteExtinctionMap
 
+# Trapezoidal integration (np.trapz was renamed to np.trapezoid in numpy 2.0)
+_trapezoid = np.trapezoid if hasattr(np, "trapezoid") else np.trapz
+
 
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
@@ -107,7 +111,7 @@ class Extinction:
 
         d = distance_sky(self.features._lon_deg[ridx].reshape(-1, 1), self.features._lat_deg[ridx].reshape(-1, 1),
                          self.features._lon_deg, self.features._lat_deg, unit="degree")
-        nnbrs = np.ceil(np.median(np.sum(d < trunc_radius / 2, axis=1))).astype(np.int)
+        nnbrs = np.ceil(np.median(np.sum(d < trunc_radius / 2, axis=1))).astype(int)
 
         # Maximum of 500 nearest neighbors
         nnbrs = 500 if nnbrs > 500 else nnbrs
@@ -178,42 +182,14 @@ class Extinction:
 
         """
 
-        if metric == "uniform" or metric == "average" or metric == "median":
-            def wfunc(wdis):
-                """
-                Returns
-                -------
-                float, np.ndarray
-
-                """
-                return np.ones_like(wdis)
-
-        elif metric == "gaussian":
-            def wfunc(wdis):
-                return np.exp(-0.5 * (wdis / bandwidth) ** 2)
-
-        elif metric == "epanechnikov":
-            # noinspection PyUnresolvedReferences
-            def wfunc(wdis):
-                val = 1 - (wdis / bandwidth) ** 2
-                val[val < 0] = 0
-                return val
-
-        elif metric == "triangular":
-            # noinspection PyUnresolvedReferences
-            def wfunc(wdis):
-                val = 1 - np.abs(wdis / bandwidth)
-                val[val < 0] = 0
-                return val
-
-        else:
-            raise TypeError("metric {0:s} not implemented".format(metric))
+        # Average and median use uniform weights
+        wfunc = _get_weight_func(metric="uniform" if metric in ["average", "median"] else metric, bandwidth=bandwidth)
 
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=RuntimeWarning)
+        # Ignore floating point warnings (due to NaNs) in the weight evaluation
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
             weights = wfunc(distances)
 
-            return np.divide(weights, np.trapz(y=wfunc(np.arange(-100, 100, 0.01)), x=np.arange(-100, 100, 0.01)))
+            return np.divide(weights, _get_weight_norm(wfunc=wfunc))
             # return weights / np.nanmax(weights, axis=0)
 
 
@@ -776,7 +752,7 @@ class ContinuousExtinction(Extinction):
 class DiscreteExtinction(Extinction):
 
     # -----------------------------------------------------------------------------
-    def __init__(self, features, extinction, variance=None):
+    def __init__(self, features, extinction, variance=None, dtype=np.float64):
         """
         Class for Intrisic features and extinction.
 
@@ -788,14 +764,17 @@ class DiscreteExtinction(Extinction):
             Extinction data.
         variance : np.ndarray, optional
             Variance in extinction.
+        dtype : np.dtype, type, optional
+            Data type of extinction and variance. Default is np.float64. np.float32 (the precision of the FITS output)
+            halves the memory, but single source pixels in the maps may then be clipped.
 
         """
 
         # TODO: Add features to docstring
 
         # Set attributes
-        self.extinction = extinction
-        self.variance = np.zeros_like(extinction) if variance is None else variance
+        self.extinction = np.asarray(extinction, dtype=dtype)
+        self.variance = np.zeros_like(self.extinction) if variance is None else np.asarray(variance, dtype=dtype)
         super(DiscreteExtinction, self).__init__(features=features)
 
         # Sanity checks
@@ -848,9 +827,11 @@ class DiscreteExtinction(Extinction):
         with warnings.catch_warnings():
             warnings.filterwarnings("ignore", category=RuntimeWarning)
 
-            # Get extinction and variance for all good neighbours
+            # Get extinction and variance for all good neighbours (in float64 so that averages and sigma clipping do
+            # not depend on the storage precision)
             bad_idx = ~np.isfinite(w_spatial)
-            nbrs_ext, nbrs_var = self.extinction[nbrs_idx], self.variance[nbrs_idx]
+            nbrs_ext = self.extinction[nbrs_idx].astype(np.float64, copy=False)
+            nbrs_var = self.variance[nbrs_idx].astype(np.float64, copy=False)
             nbrs_ext[bad_idx], nbrs_var[bad_idx] = np.nan, np.nan
 
             # Conditional choice for different metrics
@@ -967,7 +948,7 @@ class DiscreteExtinction(Extinction):
 
         d = distance_sky(self.features._lon_deg[ridx].reshape(-1, 1), self.features._lat_deg[ridx].reshape(-1, 1),
                          self.features._lon_deg, self.features._lat_deg, unit="degree")
-        nnbrs = np.ceil(np.median(np.sum(d < trunc_radius / 2, axis=1))).astype(np.int)
+        nnbrs = np.ceil(np.median(np.sum(d < trunc_radius / 2, axis=1))).astype(int)
 
         # Maximum of 500 nearest neighbors
         nnbrs = 500 if nnbrs > 500 else nnbrs
@@ -1042,8 +1023,7 @@ class DiscreteExtinction(Extinction):
                 nbrs_ext[sigfil], nbrs_var[sigfil], w_theta[sigfil], w_total[sigfil] = np.nan, np.nan, np.nan, np.nan
 
                 # Get approximate integral and normalize weights
-                w_theta = np.divide(w_theta, np.trapz(y=wfunc(np.arange(-100, 100, 0.01)),
-                                                      x=np.arange(-100, 100, 0.01)))
+                w_theta = np.divide(w_theta, _get_weight_norm(wfunc=wfunc))
 
                 # Modify weights for NICEST and calculate variance
                 if nicest:
@@ -1154,7 +1134,7 @@ class DiscreteExtinction(Extinction):
         n = np.ceil(np.min(grid_shape) * pixsize)
 
         # Determine patch size in pixels
-        patch_size = np.ceil(np.min(grid_shape) / n).astype(np.int)
+        patch_size = np.ceil(np.min(grid_shape) / n).astype(int)
 
         # Set minimum to 100 pix for effective parallelisation
         if patch_size < 100:
@@ -1165,7 +1145,7 @@ class DiscreteExtinction(Extinction):
             patch_size = 5 / pixsize
 
         # Number of patches in each dimension of the grid
-        np0, np1 = np.int(np.ceil(grid_shape[0] / patch_size)), np.int(np.ceil(grid_shape[1] / patch_size))
+        np0, np1 = int(np.ceil(grid_shape[0] / patch_size)), int(np.ceil(grid_shape[1] / patch_size))
 
         # Create patches
         grid_x_patches = [np.array_split(p, np1, axis=1) for p in np.array_split(grid_x, np0, axis=0)]
@@ -1279,22 +1259,49 @@ class DiscreteExtinction(Extinction):
 
         """
 
-        # Create FITS columns
-        col1 = fits.Column(name="Lon", format="D", array=self.features._lon_deg)
-        col2 = fits.Column(name="Lat", format="D", array=self.features._lat_deg)
-        col3 = fits.Column(name="Extinction", format="E", array=self.extinction)
-        col4 = fits.Column(name="Variance", format="E", array=self.variance)
-
-        # Column definitions
-        cols = fits.ColDefs([col1, col2, col3, col4])
+        # Fill a single table buffer (big-endian as in the file, so that it is written without further copies)
+        table = np.empty(len(self.extinction), dtype=[("Lon", ">f8"), ("Lat", ">f8"), ("Extinction", ">f4"),
+                                                      ("Variance", ">f4")])
+        table["Lon"], table["Lat"] = self.features._lon_deg, self.features._lat_deg
+        table["Extinction"], table["Variance"] = self.extinction, self.variance
 
         # Create binary table object
-        tbhdu = fits.BinTableHDU.from_columns(cols)
+        tbhdu = fits.BinTableHDU(data=table)
 
         # Write to file
         tbhdu.writeto(path, overwrite=overwrite)
 
 
+# -----------------------------------------------------------------------------
+def _w_uniform(wdis, bandwidth):
+    """ Uniform weights. """
+    return np.ones_like(wdis)
+
+
+# -----------------------------------------------------------------------------
+def _w_triangular(wdis, bandwidth):
+    """ Triangular weights. """
+    return np.maximum(1 - np.abs(wdis / bandwidth), 0)
+
+
+# -----------------------------------------------------------------------------
+def _w_gaussian(wdis, bandwidth):
+    """ Gaussian weights. """
+    return np.exp(-0.5 * (wdis / bandwidth) ** 2)
+
+
+# -----------------------------------------------------------------------------
+def _w_epanechnikov(wdis, bandwidth):
+    """ Epanechnikov weights. """
+    return np.maximum(1 - (wdis / bandwidth) ** 2, 0)
+
+
+# -----------------------------------------------------------------------------
+# Weight functions for extinction mapping
+_weight_funcs = {"uniform": _w_uniform, "triangular": _w_triangular, "gaussian": _w_gaussian,
+                 "epanechnikov": _w_epanechnikov}
+
+
 # -----------------------------------------------------------------------------
 def _get_weight_func(metric, bandwidth):
     """
@@ -1307,40 +1314,36 @@ def _get_weight_func(metric, bandwidth):
     bandwidth : int, float
         Bandwidth of metric (kernel).
 
-    """
+    Returns
+    -------
+    callable
+        Weight function of the distance (the bandwidth is already set).
 
-    if metric == "uniform":
-        def wfunc(wdis):
-            """
-            Returns
-            -------
-            float, np.ndarray
-
-            """
-            return np.ones_like(wdis)
-
-    elif metric == "triangular":
-        # noinspection PyUnresolvedReferences
-        def wfunc(wdis):
-            val = 1 - np.abs(wdis / bandwidth)
-            val[val < 0] = 0
-            return val
-
-    elif metric == "gaussian":
-        def wfunc(wdis):
-            return np.exp(-0.5 * (wdis / bandwidth) ** 2)
-
-    elif metric == "epanechnikov":
-        # noinspection PyUnresolvedReferences
-        def wfunc(wdis):
-            val = 1 - (wdis / bandwidth) ** 2
-            val[val < 0] = 0
-            return val
+    """
 
-    else:
+    if metric not in _weight_funcs:
         raise TypeError("metric {0:s} not implemented".format(metric))
 
-    return wfunc
+    return partial(_weight_funcs[metric], bandwidth=bandwidth)
+
+
+# -----------------------------------------------------------------------------
+def _get_weight_norm(wfunc):
+    """
+    Approximate integral of a weight function used to normalize the weights.
+
+    Parameters
+    ----------
+    wfunc : callable
+        Weight function (see _get_weight_func).
+
+    Returns
+    -------
+    float
+
+    """
+
+    return _trapezoid(y=wfunc(np.arange(-100, 100, 0.01)), x=np.arange(-100, 100, 0.01))
 
 
 # -----------------------------------------------------------------------------
@@ -1452,7 +1455,7 @@ def _get_extinction_pixel(lon_grid, lat_grid, x_grid, y_grid, pixsize, lon_sourc
     w_total = w_theta / var     # Weighted by variance of sources
 
     # Get approximate integral and normalize weights
-    w_theta = np.divide(w_theta, np.trapz(y=wfunc(np.arange(-100, 100, 0.01)), x=np.arange(-100, 100, 0.01)))
+    w_theta = np.divide(w_theta, _get_weight_norm(wfunc=wfunc))
 
     # Modify weights for NICEST
     if nicest:
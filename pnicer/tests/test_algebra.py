@@ -0,0 +1,22 @@
+# -----------------------------------------------------------------------------
+# Import packages
+import numpy as np
+
+from numpy.testing import assert_allclose
+
+from pnicer.utils.algebra import partition_percentiles
+
+
+# -----------------------------------------------------------------------------
+def test_partition_percentiles():
+    """ Percentiles from the partial sort must match np.percentile (linear interpolation). """
+
+    rng = np.random.RandomState(0)
+    percentiles = [0, 0.01, 1, 25, 50, 50, 99.5, 100]
+
+    for size in [1, 2, 7, 1000, 1001]:
+        data = rng.normal(0, 1, size=size)
+        assert_allclose(partition_percentiles(data, percentiles), np.percentile(data, percentiles), rtol=1e-12)
+
+    # Empty input gives NaN for each percentile
+    assert np.all(np.isnan(partition_percentiles(np.array([]), percentiles)))
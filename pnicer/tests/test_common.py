@@ -0,0 +1,53 @@
+# -----------------------------------------------------------------------------
+# Import packages
+import numpy as np
+
+from numpy.testing import assert_allclose
+
+from pnicer.user import ApparentMagnitudes
+from pnicer.common import ExtinctionVector
+from pnicer.utils.gmm import gmm_population_variance
+
+
+# -----------------------------------------------------------------------------
+def test_pnicer_multivariate_variance():
+    """ Each source must get the variance of the model it is assigned to, also when grid points have no model. """
+
+    rng = np.random.RandomState(1)
+
+    # Control field with a gap in the second feature, so that grid points in between get no model
+    n = 2000
+    con = [np.concatenate([rng.normal(0, 0.1, n), rng.normal(0, 0.5, n)]),
+           np.concatenate([rng.uniform(0, 0.3, n), rng.uniform(0.7, 1, n)])]
+    sci = [rng.normal(0, 0.3, 500), rng.uniform(0, 1, 500)]
+
+    # The extinction vector along the first feature leaves the second feature unrotated
+    control = ApparentMagnitudes(magnitudes=con, errors=[np.full(2 * n, 0.1)] * 2, extvec=[1., 0.])
+    science = ApparentMagnitudes(magnitudes=sci, errors=[np.full(500, 0.1)] * 2, extvec=[1., 0.])
+
+    # Run PNICER
+    gmms, var, idx, _ = science._pnicer_multivariate(control=control, max_components=1, parallel=False)
+
+    # Compare with the variance of the assigned models
+    good = idx >= 0
+    assert np.all(good)
+    assert_allclose(var[good], [gmm_population_variance(gmm=gmms[i], method="weighted") for i in idx[good]],
+                    rtol=1e-6)
+
+
+# -----------------------------------------------------------------------------
+def test_rotmatrix():
+    """ The rotation must be proper and map the extinction vector onto the first axis. """
+
+    for extvec in [[1.55, 1.0], [2.5, 1.55, 1.0], [2.5, 1.55, 1.0, 0.6], [1.0, 2.0, 3.0, 0.1, 0.2]]:
+        extvec = np.array(extvec)
+        rotmatrix = ExtinctionVector._get_rotmatrix(extvec)
+
+        # Orthogonal with determinant +1
+        assert_allclose(rotmatrix.dot(rotmatrix.T), np.identity(len(extvec)), atol=1e-12)
+        assert_allclose(np.linalg.det(rotmatrix), 1., rtol=1e-12)
+
+        # Rotated vector has only a (positive) first component
+        extvec_rot = rotmatrix.dot(extvec)
+        assert_allclose(extvec_rot[0], np.linalg.norm(extvec), rtol=1e-12)
+        assert_allclose(extvec_rot[1:], 0., atol=1e-12)
@@ -0,0 +1,29 @@
+# -----------------------------------------------------------------------------
+# Import packages
+import pytest
+import numpy as np
+
+from numpy.testing import assert_allclose
+
+# The compiled kernels require numba
+jit = pytest.importorskip("pnicer.utils.jit")
+
+
+# -----------------------------------------------------------------------------
+def test_tridiagonal_solve():
+    """ The Thomas algorithm must agree with a dense solve for symmetric positive definite tridiagonal systems. """
+
+    rng = np.random.RandomState(0)
+    for n_dimensions in [1, 2, 3, 6]:
+        n_systems = 50
+
+        # Diagonally dominant systems (as the NICER covariance matrices) with a common right-hand side
+        off = rng.uniform(-1, 1, size=(n_systems, n_dimensions - 1))
+        diag = rng.uniform(2, 3, size=(n_systems, n_dimensions))
+        rhs = rng.uniform(-1, 1, size=n_dimensions)
+
+        # Dense reference
+        matrices = np.array([np.diag(d) + np.diag(o, 1) + np.diag(o, -1) for d, o in zip(diag, off)])
+        sol_ref = np.linalg.solve(matrices, np.broadcast_to(rhs, (n_systems, n_dimensions))[..., np.newaxis])[..., 0]
+
+        assert_allclose(jit.tridiagonal_solve(diag, off, rhs), sol_ref, rtol=1e-10, atol=1e-12)
@@ -0,0 +1,72 @@
+# -----------------------------------------------------------------------------
+# Import packages
+import pytest
+import numpy as np
+
+from numpy.testing import assert_allclose
+# noinspection PyPackageRequirements
+from sklearn.neighbors import KernelDensity
+
+from pnicer.utils.kde import fft_kde, mp_kde, _sparse_epanechnikov_kde, _epanechnikov_norm
+
+
+# -----------------------------------------------------------------------------
+def _sklearn_kde(grid, data, bandwidth, kernel="epanechnikov"):
+    """ Reference density from scikit-learn. """
+    return np.exp(KernelDensity(kernel=kernel, bandwidth=bandwidth).fit(data).score_samples(grid))
+
+
+# -----------------------------------------------------------------------------
+def test_fft_kde():
+    """ The gridded KDE must agree with the exact density up to the binning to the grid. """
+
+    rng = np.random.RandomState(0)
+    data = rng.normal(0, 1, size=(2000, 2))
+    axes = [np.arange(-3, 3.001, 0.05)] * 2
+
+    # Gridded and exact density
+    dens = fft_kde(data=data, axes=axes, bandwidth=0.3, kernel="gaussian")
+    grid = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 2)
+    dens_ref = _sklearn_kde(grid=grid, data=data, bandwidth=0.3, kernel="gaussian").reshape(dens.shape)
+
+    assert dens.shape == (len(axes[0]), len(axes[1]))
+    assert_allclose(dens, dens_ref, atol=0.02 * dens_ref.max())
+
+
+# -----------------------------------------------------------------------------
+def test_epanechnikov_kde():
+    """ The compiled kernel must give the same kernel sums and densities as the numpy and scikit-learn versions. """
+
+    jit = pytest.importorskip("pnicer.utils.jit")
+
+    rng = np.random.RandomState(0)
+    for n_dimensions in [1, 2, 3]:
+        data = rng.normal(0, 1, size=(1000, n_dimensions))
+        grid = rng.uniform(-3, 3, size=(200, n_dimensions))
+
+        # Kernel sums
+        r2 = np.sum((grid[:, np.newaxis] - data[np.newaxis]) ** 2, axis=-1) / 0.5 ** 2
+        assert_allclose(jit.epanechnikov_kde(grid, data, 0.5), np.sum(np.clip(1 - r2, 0, None), axis=1), rtol=1e-10)
+
+        # Normalized density (mp_kde uses the compiled kernel for small samples)
+        assert_allclose(mp_kde(grid=grid, data=data, bandwidth=0.5), _sklearn_kde(grid=grid, data=data, bandwidth=0.5),
+                        rtol=1e-10, atol=1e-12)
+
+
+# -----------------------------------------------------------------------------
+def test_sparse_epanechnikov_kde():
+    """ The sparse pair sums must reproduce the scikit-learn density, also when the grid is split into chunks. """
+
+    rng = np.random.RandomState(0)
+    for n_dimensions in [1, 2, 3]:
+        data = rng.normal(0, 1, size=(6000, n_dimensions))
+        grid = rng.uniform(-3, 3, size=(300, n_dimensions))
+        dens_ref = _sklearn_kde(grid=grid, data=data, bandwidth=0.5)
+
+        # Chunked evaluation with a small memory budget
+        dens = _sparse_epanechnikov_kde(grid=grid, data=data, bandwidth=0.5, max_pairs=1000)
+        dens *= _epanechnikov_norm(n_dimensions=n_dimensions, bandwidth=0.5) / data.shape[0]
+        assert_allclose(dens, dens_ref, rtol=1e-10, atol=1e-12)
+
+        # mp_kde uses the sparse evaluation for larger low dimensional samples
+        assert_allclose(mp_kde(grid=grid, data=data, bandwidth=0.5), dens_ref, rtol=1e-10, atol=1e-12)
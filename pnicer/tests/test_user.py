@@ -0,0 +1,129 @@
+# -----------------------------------------------------------------------------
+# Import packages
+import pytest
+import numpy as np
+
+from numpy.testing import assert_allclose
+
+from pnicer.user import ApparentMagnitudes
+
+
+# -----------------------------------------------------------------------------
+def _magnitudes(rng, n, extvec, extinction):
+    """ Reddened magnitudes with missing bands, including sources with only one or no band at all. """
+
+    intrinsic = np.array([16., 15.4, 15.2, 15.1])[:, np.newaxis] + rng.normal(0, 0.2, size=(len(extvec), n))
+    errors = rng.uniform(0.02, 0.2, size=(len(extvec), n))
+    magnitudes = intrinsic + np.outer(extvec, extinction) + rng.normal(0, 1, size=errors.shape) * errors
+
+    # Drop bands at random and for the first sources all, all but one, two non-adjacent, and all but two adjacent bands
+    missing = rng.uniform(0, 1, size=magnitudes.shape) < 0.15
+    missing[:, :4] = [[1, 1, 0, 1], [1, 0, 1, 0], [1, 1, 0, 0], [1, 1, 1, 1]]
+    magnitudes[missing], errors[missing] = np.nan, np.nan
+
+    return ApparentMagnitudes(magnitudes=list(magnitudes), errors=list(errors), extvec=extvec)
+
+
+# -----------------------------------------------------------------------------
+def _nicer_reference(science, control=None, color0=None, color0_err=None, min_features=None):
+    """ NICER with the inverted dense total covariance matrices (Lombardi & Alves 2001, equ. 12 and 13). """
+
+    n_colors = science.n_features - 1
+    k = -np.diff(science.extvec.extvec)
+
+    # Covariance matrix and intrinsic colors of the control field or manual intrinsic colors
+    if control is not None:
+        f = control.features
+        cov_cf = np.ma.cov([np.ma.masked_invalid(f[l]) - np.ma.masked_invalid(f[l + 1]) for l in range(n_colors)])
+        _color0 = [np.nanmean(f[l] - f[l + 1]) for l in range(n_colors)]
+    else:
+        cov_cf, _color0 = np.zeros((n_colors, n_colors)), color0
+        if color0_err is not None:
+            cov_cf[np.diag_indices(n_colors)] = np.square(color0_err)
+
+    # Covariance matrix of the errors in the science field
+    errors = [np.where(np.isfinite(e), e, 100) for e in science.features_err]
+    cov_er = np.zeros([science.n_data, n_colors, n_colors])
+    for i in range(n_colors):
+        cov_er[:, i, i] = errors[i] ** 2 + errors[i + 1] ** 2
+        if i > 0:
+            cov_er[:, i, i - 1] = cov_er[:, i - 1, i] = -errors[i] ** 2
+
+    # Weights
+    upper = np.dot(np.linalg.inv(np.ma.getdata(cov_cf) + cov_er), k)
+    lower = np.dot(k, upper.T)
+    b = upper.T / lower
+
+    # Colors with NaNs set to 0, except for sources without any color
+    scolors = np.array([science.features[l] - science.features[l + 1] for l in range(n_colors)])
+    bad_color = np.all(np.isnan(scolors), axis=0)
+    scolors[~np.isfinite(scolors)] = 0
+    scolors[:, bad_color] = np.nan
+
+    # Extinction and variance
+    ext = np.sum([b[i] * (scolors[i] - _color0[i]) for i in range(n_colors)], axis=0)
+    var = 1 / lower
+    var[~np.isfinite(ext)] = np.nan
+
+    if min_features is not None:
+        n_good = np.sum(np.vstack(science._features_masks), axis=0)
+        ext[n_good < min_features] = var[n_good < min_features] = np.nan
+
+    return ext, var
+
+
+# -----------------------------------------------------------------------------
+def _check_nicer(calls=None):
+    """ Compare NICER for all input variants with the reference and, if calls are recorded, the solver dispatch. """
+
+    rng = np.random.RandomState(0)
+    extvec = [2.5, 1.55, 1.0, 0.6]
+    science = _magnitudes(rng=rng, n=500, extvec=extvec, extinction=rng.uniform(0, 3, size=500))
+    control = _magnitudes(rng=rng, n=2000, extvec=extvec, extinction=np.zeros(2000))
+    color0, color0_err = [0.6, 0.2, 0.1], [0.15, 0.1, 0.05]
+
+    for kwargs, uses_tridiagonal in [(dict(control=control), False),
+                                     (dict(color0=color0), True),
+                                     (dict(color0=color0, color0_err=color0_err), True)]:
+        for min_features in [None, 3]:
+
+            n_calls = 0 if calls is None else len(calls)
+            nicer = science.nicer(min_features=min_features, **kwargs)
+            ext_ref, var_ref = _nicer_reference(science=science, min_features=min_features, **kwargs)
+
+            # Only the covariance matrices without control field colour covariances are tridiagonal
+            if calls is not None:
+                assert len(calls) - n_calls == int(uses_tridiagonal)
+
+            # Sources without colors or with too few bands are masked, NaNs elsewhere are only down-weighted
+            assert np.isnan(nicer.extinction[:3]).all()
+            assert np.isfinite(nicer.extinction[3:]).any()
+            assert np.isfinite(nicer.extinction[3]) == (min_features is None)
+            assert_allclose(nicer.extinction, ext_ref, rtol=1e-6, atol=1e-6, equal_nan=True)
+            assert_allclose(nicer.variance, var_ref, rtol=1e-6, equal_nan=True)
+            assert np.array_equal(np.isnan(nicer.extinction), np.isnan(nicer.variance))
+
+
+# -----------------------------------------------------------------------------
+def test_nicer(monkeypatch):
+    """ NICER with the compiled solver for tridiagonal systems must agree with the inverted covariance matrices. """
+
+    jit = pytest.importorskip("pnicer.utils.jit")
+
+    # Record the calls of the tridiagonal solver
+    calls = []
+
+    def _tridiagonal_solve(*args):
+        calls.append(args)
+        return jit.tridiagonal_solve(*args)
+
+    monkeypatch.setattr("pnicer.user.tridiagonal_solve", _tridiagonal_solve)
+    _check_nicer(calls=calls)
+
+
+# -----------------------------------------------------------------------------
+def test_nicer_dense(monkeypatch):
+    """ Without numba all systems are solved with the inverted covariance matrices. """
+
+    monkeypatch.setattr("pnicer.user.tridiagonal_solve", None)
+    _check_nicer()
@@ -5,12 +5,18 @@ import numpy as np
 from pnicer.common import Features
 from pnicer.utils.algebra import get_sample_covar, get_color_covar
 
+# Compiled kernels are optional
+try:
+    from pnicer.utils.jit import tridiagonal_solve
+except ImportError:
+    tridiagonal_solve = None
+
 
 # ----------------------------------------------------------------------------- #
 # ----------------------------------------------------------------------------- #
 class Magnitudes(Features):
 
-    def __init__(self, magnitudes, errors, extvec, coordinates=None, names=None):
+    def __init__(self, magnitudes, errors, extvec, coordinates=None, names=None, dtype=np.float32):
         """
         Generic magnitude data class.
 
@@ -26,11 +32,13 @@ class Magnitudes(Features):
             Astropy SkyCoord instance.
         names : list, optional
             List of magnitude (feature) names.
+        dtype : np.dtype, optional
+            Data type in which magnitudes and errors are stored. Default is np.float32.
 
         """
 
         super(Magnitudes, self).__init__(features=magnitudes, feature_err=errors, feature_extvec=extvec,
-                                         feature_names=names, feature_coordinates=coordinates)
+                                         feature_names=names, feature_coordinates=coordinates, dtype=dtype)
 
     # -----------------------------------------------------------------------------
     def mag2color(self):
@@ -45,11 +53,10 @@ class Magnitudes(Features):
         """
 
         # Calculate colors
-        colors = [self.features[k - 1] - self.features[k] for k in range(1, self.n_features)]
+        colors = -np.diff(self.features, axis=0)
 
         # Calculate color errors
-        colors_error = [np.sqrt(self.features_err[k - 1] ** 2 + self.features_err[k] ** 2)
-                        for k in range(1, self.n_features)]
+        colors_error = np.sqrt(self.features_err[:-1] ** 2 + self.features_err[1:] ** 2)
 
         # Color names
         color_extvec = [self.extvec.extvec[k - 1] - self.extvec.extvec[k] for k in range(1, self.n_features)]
@@ -59,12 +66,12 @@ class Magnitudes(Features):
 
         # Return Colors instance
         return ApparentColors(colors=colors, errors=colors_error, extvec=color_extvec,
-                              coordinates=self.coordinates, names=names)
+                              coordinates=self.coordinates, names=names, dtype=self.dtype)
 
     # -----------------------------------------------------------------------------
     @classmethod
     def from_fits(cls, path, mag_names, err_names, extvec, extension=1,
-                  lon_name=None, lat_name=None, coo_unit="deg", frame=None):
+                  lon_name=None, lat_name=None, coo_unit="deg", frame=None, dtype=np.float32):
         """
         Read data from a given FITS file and return a PNICER Magnitude (or Color) instance.
 
@@ -88,6 +95,8 @@ class Magnitudes(Features):
             The unit of the coordinates. Default is 'deg'.
         frame : str, optional
             The coordinate system. Either 'icrs' or 'galactic'.
+        dtype : np.dtype, optional
+            Data type in which magnitudes and errors are stored. Default is np.float32.
 
         Returns
         -------
@@ -128,15 +137,15 @@ class Magnitudes(Features):
                 coo = None
 
         # Instantiate and return
-        return cls(magnitudes=mag, errors=err, extvec=extvec, coordinates=coo, names=mag_names)
+        return cls(magnitudes=mag, errors=err, extvec=extvec, coordinates=coo, names=mag_names, dtype=dtype)
 
 
 # ----------------------------------------------------------------------------- #
 # ----------------------------------------------------------------------------- #
 class Colors(Features):
-    def __init__(self, colors, errors, extvec, coordinates=None, names=None):
+    def __init__(self, colors, errors, extvec, coordinates=None, names=None, dtype=np.float32):
         super(Colors, self).__init__(features=colors, feature_err=errors, feature_extvec=extvec, feature_names=names,
-                                     feature_coordinates=coordinates)
+                                     feature_coordinates=coordinates, dtype=dtype)
 
 
 # ----------------------------------------------------------------------------- #
@@ -145,7 +154,7 @@ class Colors(Features):
 class ApparentMagnitudes(Magnitudes):
 
     # -----------------------------------------------------------------------------
-    def __init__(self, magnitudes, errors, extvec, coordinates=None, names=None):
+    def __init__(self, magnitudes, errors, extvec, coordinates=None, names=None, dtype=np.float32):
         """
         Main class for users with magnitude data. Includes PNICER and NICER.
 
@@ -161,12 +170,14 @@ class ApparentMagnitudes(Magnitudes):
             Astropy SkyCoord instance.
         names : list, optional
             List of magnitude (feature) names.
+        dtype : np.dtype, optional
+            Data type in which magnitudes and errors are stored. Default is np.float32.
 
         """
 
         # Call parent
         super(ApparentMagnitudes, self).__init__(magnitudes=magnitudes, errors=errors, extvec=extvec,
-                                                 coordinates=coordinates, names=names)
+                                                 coordinates=coordinates, names=names, dtype=dtype)
 
     # -----------------------------------------------------------------------------
     def _color_combinations(self):
@@ -262,17 +273,19 @@ class ApparentMagnitudes(Magnitudes):
                 raise ValueError("Must request at least one feature")
 
         # Get reddening vector
-        k = [x - y for x, y in zip(self.extvec.extvec[:-1], self.extvec.extvec[1:])]
+        k = -np.diff(self.extvec.extvec)
 
         # Calculate covariance matrix of control field and intrinsic colors
         if control is not None:
 
+            # Colors of the control field
+            control_colors = -np.diff(control.features, axis=0)
+
             # Matrix
-            cov_cf = np.ma.cov([np.ma.masked_invalid(control.features[l]) -
-                                np.ma.masked_invalid(control.features[l + 1]) for l in range(self.n_features - 1)])
+            cov_cf = np.ma.cov(np.ma.masked_invalid(control_colors))
 
             # Intrinsic colors
-            _color0 = [np.nanmean(control.features[l] - control.features[l + 1]) for l in range(control.n_features - 1)]
+            _color0 = np.nanmean(control_colors, axis=1)
 
         # If no control field is given, set the matrix to 0 and the intrinsic colors manually
         elif color0 is not None:
@@ -288,50 +301,45 @@ class ApparentMagnitudes(Magnitudes):
             raise ValueError("Must specify either control field or intrinsic colors")
 
         # Set errors to large value for down-weighting
-        errors = []
-        for e in self.features_err:
-            errors.append(e.copy())
-            errors[-1][~np.isfinite(errors[-1])] = 100
-
-        # Calculate covariance matrix of errors in the science field
-        cov_er = np.zeros([self.n_data, self.n_features - 1, self.n_features - 1])
-        for i in range(self.n_features - 1):
+        errors_sq = np.where(np.isfinite(self.features_err), self.features_err, 100) ** 2
 
-            # Diagonal entries
-            cov_er[:, i, i] = errors[i] ** 2 + errors[i + 1] ** 2
+        # Diagonal and cross entries of the covariance matrix of errors in the science field (tridiagonal)
+        er_diag, er_off = (errors_sq[:-1] + errors_sq[1:]).T, -errors_sq[1:-1].T
+        cov_cf = np.atleast_2d(np.ma.getdata(cov_cf))
 
-            # Cross entries
-            if i > 0:
-                cov_er[:, i, i - 1] = cov_er[:, i - 1, i] = -errors[i] ** 2
+        # Without colour covariances from a control field the total covariance matrix stays tridiagonal and the systems
+        # for the weights can be solved in linear time.
+        if (tridiagonal_solve is not None) & (np.count_nonzero(cov_cf - np.diag(np.diag(cov_cf))) == 0):
+            upper = tridiagonal_solve(np.ascontiguousarray(er_diag + np.diag(cov_cf), dtype=np.float64),
+                                      np.ascontiguousarray(er_off, dtype=np.float64), k.astype(np.float64))
 
-        # Calculate total covariance matrix and invert
-        cov_inv = np.linalg.inv(cov_cf + cov_er)
+        # Otherwise invert the full total covariance matrices
+        else:
+            diag = np.arange(self.n_features - 1)
+            cov_er = np.zeros([self.n_data, self.n_features - 1, self.n_features - 1])
+            cov_er[:, diag, diag] = er_diag
+            cov_er[:, diag[1:], diag[:-1]] = cov_er[:, diag[:-1], diag[1:]] = er_off
+            upper = np.dot(np.linalg.inv(cov_cf + cov_er), k)
 
         # Get b from the paper (equ. 12)
-        upper = np.dot(cov_inv, k)
         lower = np.dot(k, upper.T)
         b = upper.T / lower
 
-        # Get colors
-        scolors = np.array([self.features[l] - self.features[l + 1] for l in range(self.n_features - 1)])
-
-        # Get those with no good color value at all
-        bad_color = np.all(np.isnan(scolors), axis=0)
+        # Get colors and write finite value for all NaNs (this makes summing easier)
+        scolors = self.features[:-1] - self.features[1:]
+        finite = np.isfinite(scolors)
+        scolors = np.where(finite, scolors, 0)
 
-        # Write finite value for all NaNs (this makes summing later easier)
-        scolors[~np.isfinite(scolors)] = 0
-
-        # Put back NaNs for those with only bad colors
-        scolors[:, bad_color] = np.nan
-
-        # Calculate extinction (equation 13 in NICER paper)
-        ext = b[0, :] * (scolors[0, :] - _color0[0])
-        for i in range(1, self.n_features - 1):
-            ext += b[i, :] * (scolors[i, :] - _color0[i])
+        # Calculate extinction (equation 13 in NICER paper; colour excesses in the precision of the features, weighted
+        # sum in float64)
+        ext = np.sum(b * (scolors - np.asarray(_color0, dtype=scolors.dtype)[:, np.newaxis]), axis=0)
 
         # Calculate variance
         var = 1 / lower
-        var[~np.isfinite(ext)] = np.nan
+
+        # Mask sources with no good color value at all and those without valid weights or extinction
+        bad = ~finite.any(axis=0) | ~np.isfinite(ext) | ~np.all(np.isfinite(b), axis=0)
+        ext[bad], var[bad] = np.nan, np.nan
 
         if min_features is not None:
             mask = np.where(np.sum(np.vstack(self._features_masks), axis=0, dtype=int) < min_features)[0]
@@ -340,11 +348,6 @@ class ApparentMagnitudes(Magnitudes):
         # Calculate intrinsic magnitudes
         # intrinsic = [self.features[idx] - self.extvec.extvec[idx] * ext for idx in range(self.n_features)]
 
-        # Convert to unmasked arrays
-        mask = ext.mask
-        ext, var = ext.data, var.data
-        ext[mask], var[mask] = np.nan, np.nan
-
         # Return Intrinsic instance
         from pnicer.extinction import DiscreteExtinction
         return DiscreteExtinction(features=self, extinction=ext, variance=var)
@@ -657,7 +660,7 @@ class ApparentMagnitudes(Magnitudes):
 class ApparentColors(Colors):
 
     # -----------------------------------------------------------------------------
-    def __init__(self, colors, errors, extvec, coordinates=None, names=None):
+    def __init__(self, colors, errors, extvec, coordinates=None, names=None, dtype=np.float32):
         """
         Main class for users with color data.
 
@@ -673,6 +676,8 @@ class ApparentColors(Colors):
             List holding the extinction components for each color.
         names : list, optional
             List of color (feature) names.
+        dtype : np.dtype, optional
+            Data type in which colors and errors are stored. Default is np.float32.
 
         Returns
         -------
@@ -681,7 +686,7 @@ class ApparentColors(Colors):
 
         # Call parent
         super(ApparentColors, self).__init__(colors=colors, errors=errors, extvec=extvec, coordinates=coordinates,
-                                             names=names)
+                                             names=names, dtype=dtype)
 
     # -----------------------------------------------------------------------------
     def pnicer(self, control, max_components=3, **kwargs):
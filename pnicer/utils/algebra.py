@@ -7,6 +7,9 @@ import numpy as np
 # Useful constants
 std2fwhm = 2 * np.sqrt(2 * np.log(2))
 
+# Trapezoidal integration (np.trapz was renamed to np.trapezoid in numpy 2.0)
+_trapezoid = np.trapezoid if hasattr(np, "trapezoid") else np.trapz
+
 
 # -----------------------------------------------------------------------------
 def gauss_function(x, amp, x0, sigma, area=None):
@@ -39,7 +42,7 @@ def gauss_function(x, amp, x0, sigma, area=None):
     # Normalize
     if area is not None:
         # noinspection PyTypeChecker
-        gauss /= np.trapz(gauss, x) / area
+        gauss /= _trapezoid(gauss, x) / area
 
     # Return
     return gauss
@@ -186,6 +189,43 @@ def round_partial(data, precision):
     return np.around(data / precision) * precision
 
 
+# -----------------------------------------------------------------------------
+def partition_percentiles(data, percentiles):
+    """
+    Calculates percentiles with linear interpolation (same as np.percentile) from a single partial sort of the data.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Input data (can not contain NaNs!).
+    percentiles : iterable
+        Percentiles to compute (between 0 and 100).
+
+    Returns
+    -------
+    np.ndarray
+        Percentiles of data.
+
+    """
+
+    # Flatten input
+    data = np.asarray(data).ravel()
+
+    # Return NaNs for empty input
+    if data.size == 0:
+        return np.full(len(percentiles), fill_value=np.nan)
+
+    # Positions in the sorted array
+    pos = np.asarray(percentiles, dtype=float) / 100 * (data.size - 1)
+    lo, hi = np.floor(pos).astype(int), np.ceil(pos).astype(int)
+
+    # Only partition around the required order statistics
+    part = np.partition(data, np.unique(np.concatenate([lo, hi])))
+
+    # Interpolate and return
+    return part[lo] + (part[hi] - part[lo]) * (pos - lo)
+
+
 # -----------------------------------------------------------------------------
 def get_color_covar(magerr1, magerr2, magerr3, magerr4, name1, name2, name3, name4):
     """
@@ -4,12 +4,20 @@ import numpy as np
 import multiprocessing
 
 from itertools import repeat
-from collections import Iterable
-from scipy.integrate import cumtrapz
+from collections.abc import Iterable
 # noinspection PyPackageRequirements
 from sklearn.mixture import GaussianMixture
 from pnicer.utils.algebra import gauss_function
 
+# scipy 1.6 renamed cumtrapz to cumulative_trapezoid (the old name was removed in scipy 1.14)
+try:
+    from scipy.integrate import cumulative_trapezoid
+except ImportError:
+    from scipy.integrate import cumtrapz as cumulative_trapezoid
+
+# Trapezoidal integration (np.trapz was renamed to np.trapezoid in numpy 2.0)
+_trapezoid = np.trapezoid if hasattr(np, "trapezoid") else np.trapz
+
 
 # -----------------------------------------------------------------------------
 def gmm_scale(gmm, shift=None, scale=None, reverse=False, params=None):
@@ -273,7 +281,7 @@ def gmm_expected_value(gmm, method="weighted", sampling=50):
         xrange, yrange = gmm_sample_xy(gmm=gmm, kappa=10, sampling=sampling)
 
         # Return expected value
-        return np.trapz(xrange * yrange, xrange)
+        return _trapezoid(xrange * yrange, xrange)
 
     # Raise error if invalid method specified
     else:
@@ -318,7 +326,7 @@ def gmm_population_variance(gmm, method="weighted", sampling=50):
         xrange, yrange = gmm_sample_xy(gmm=gmm, kappa=10, sampling=sampling)
 
         # Return population variance
-        return np.trapz(np.power(xrange, 2) * yrange, xrange) - ev ** 2
+        return _trapezoid(np.power(xrange, 2) * yrange, xrange) - ev ** 2
 
     # Raise error if invalid method specified
     else:
@@ -350,7 +358,7 @@ def gmm_confidence_interval(gmm, level=0.9, sampling=50):
     xrange, yrange = gmm_sample_xy(gmm=gmm, kappa=10, sampling=sampling)
 
     # Cumulative integral
-    cumint = cumtrapz(y=yrange, x=xrange, initial=0)
+    cumint = cumulative_trapezoid(y=yrange, x=xrange, initial=0)
 
     # Return interval
     return tuple(np.interp([(1 - level) / 2, level + (1 - level) / 2], cumint, xrange))
@@ -377,8 +385,8 @@ def gmm_confidence_interval_value(gmm, value, level=0.95):
         ridx = value_idx + i if value_idx + i < len(gmm_x) else len(gmm_x) - 1
 
         # Need to separate left and right integral due to asymmetry
-        lint = np.trapz(gmm_y[lidx:value_idx], dx=dx)
-        rint = np.trapz(gmm_y[value_idx:ridx], dx=dx)
+        lint = _trapezoid(gmm_y[lidx:value_idx], dx=dx)
+        rint = _trapezoid(gmm_y[value_idx:ridx], dx=dx)
 
         # Sum of both sides
         # integral = np.trapz(gmm_y[lidx:ridx], dx=dx)
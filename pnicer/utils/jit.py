@@ -0,0 +1,105 @@
+# -----------------------------------------------------------------------------
+# Import packages
+import os
+import numba
+import numpy as np
+
+# Compiled kernels for the hot loops of PNICER. This module requires numba and is only imported by the other modules
+# when it is available. Otherwise they fall back to their numpy/scikit-learn implementations.
+
+# PNICER also forks worker pools. Unless the user chose a threading layer, prefer those which do not block the
+# interpreter exit when forking after the threads were launched (as observed for TBB).
+if "NUMBA_THREADING_LAYER" not in os.environ and "NUMBA_THREADING_LAYER_PRIORITY" not in os.environ:
+    numba.config.THREADING_LAYER_PRIORITY = ["omp", "workqueue", "tbb"]
+
+
+# -----------------------------------------------------------------------------
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def epanechnikov_kde(grid, data, bandwidth):
+    """
+    Sums the (unnormalized) Epanechnikov kernel contributions of all data points for each grid point.
+
+    Parameters
+    ----------
+    grid : np.ndarray
+        Grid on which to evaluate the density with shape (n_grid, n_dimensions).
+    data : np.ndarray
+        Input data with shape (n_data, n_dimensions).
+    bandwidth : float
+        Bandwidth of kernel (in data units).
+
+    Returns
+    -------
+    np.ndarray
+        Kernel sums for each grid point.
+
+    """
+
+    n_grid, n_dim = grid.shape
+    h2 = bandwidth ** 2
+    dens = np.zeros(n_grid)
+
+    for i in numba.prange(n_grid):
+        acc = 0.
+        for j in range(data.shape[0]):
+
+            # Early out if any dimension is outside the kernel support
+            r2, inside = 0., True
+            for k in range(n_dim):
+                d = grid[i, k] - data[j, k]
+                if abs(d) >= bandwidth:
+                    inside = False
+                    break
+                r2 += d * d
+
+            if inside and r2 < h2:
+                acc += 1. - r2 / h2
+
+        dens[i] = acc
+
+    return dens
+
+
+# -----------------------------------------------------------------------------
+@numba.njit(parallel=True, cache=True)
+def tridiagonal_solve(diag, off, rhs):
+    """
+    Solves many symmetric tridiagonal linear systems with the same right-hand side (Thomas algorithm).
+
+    Parameters
+    ----------
+    diag : np.ndarray
+        Diagonals of the matrices with shape (n_systems, n_dimensions).
+    off : np.ndarray
+        Off-diagonals of the matrices with shape (n_systems, n_dimensions - 1).
+    rhs : np.ndarray
+        Right-hand side with shape (n_dimensions,).
+
+    Returns
+    -------
+    np.ndarray
+        Solutions with shape (n_systems, n_dimensions).
+
+    """
+
+    n_systems, n_dim = diag.shape
+    sol = np.empty((n_systems, n_dim))
+
+    for i in numba.prange(n_systems):
+        c, d = np.zeros(n_dim), np.empty(n_dim)
+
+        # Forward sweep
+        m = diag[i, 0]
+        d[0] = rhs[0] / m
+        for j in range(1, n_dim):
+            c[j - 1] = off[i, j - 1] / m
+            m = diag[i, j] - off[i, j - 1] * c[j - 1]
+            d[j] = (rhs[j] - off[i, j - 1] * d[j - 1]) / m
+
+        # Back substitution
+        sol[i, n_dim - 1] = d[n_dim - 1]
+        for j in range(n_dim - 2, -1, -1):
+            sol[i, j] = d[j] - c[j] * sol[i, j + 1]
+
+    return sol
+
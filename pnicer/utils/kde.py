@@ -3,10 +3,29 @@
 import numpy as np
 import multiprocessing
 
-from itertools import repeat
+from math import lgamma
+from scipy.signal import fftconvolve
+from scipy.spatial import cKDTree
 # noinspection PyPackageRequirements
 from sklearn.neighbors import KernelDensity
 
+# Compiled kernels are optional
+try:
+    from pnicer.utils.jit import epanechnikov_kde
+except ImportError:
+    epanechnikov_kde = None
+
+
+# -----------------------------------------------------------------------------
+# Kernel profiles and truncation radii (in units of the bandwidth) for gridded KDE
+_kernel_profiles = {"gaussian": lambda u: np.exp(-0.5 * u ** 2),
+                    "tophat": lambda u: (u < 1).astype(float),
+                    "epanechnikov": lambda u: np.clip(1 - u ** 2, 0, None),
+                    "exponential": lambda u: np.exp(-u),
+                    "linear": lambda u: np.clip(1 - u, 0, None),
+                    "cosine": lambda u: np.where(u < 1, np.cos(np.pi * u / 2), 0.)}
+_kernel_truncation = {"gaussian": 4, "tophat": 1, "epanechnikov": 1, "exponential": 8, "linear": 1, "cosine": 1}
+
 
 # -----------------------------------------------------------------------------
 def mp_kde(grid, data, bandwidth, kernel="epanechnikov", norm=None, absolute=False, sampling=None):
@@ -50,46 +69,256 @@ def mp_kde(grid, data, bandwidth, kernel="epanechnikov", norm=None, absolute=Fal
         grid = grid[:, np.newaxis]
         data = data[:, np.newaxis]
 
-    # Split for parallel processing
-    grid_split = np.array_split(grid, multiprocessing.cpu_count(), axis=0)
+    # For small samples the compiled kernel beats the tree-based evaluation
+    if (kernel == "epanechnikov") & (data.shape[0] < 5000) & (epanechnikov_kde is not None):
+        dens = epanechnikov_kde(np.ascontiguousarray(grid, dtype=np.float64),
+                                np.ascontiguousarray(data, dtype=np.float64), float(bandwidth))
+        dens *= _epanechnikov_norm(n_dimensions=data.shape[1], bandwidth=bandwidth) / data.shape[0]
+        return _kde_normalize(dens=dens, n_data=data.shape[0], norm=norm, absolute=absolute, sampling=sampling)
+
+    # In low dimensions summing the kernel over all pairs within the bandwidth beats scikit-learn's tree traversal
+    if (kernel == "epanechnikov") & (data.shape[1] <= 3):
+        dens = _sparse_epanechnikov_kde(grid=grid, data=data, bandwidth=bandwidth)
+        dens *= _epanechnikov_norm(n_dimensions=data.shape[1], bandwidth=bandwidth) / data.shape[0]
+        return _kde_normalize(dens=dens, n_data=data.shape[0], norm=norm, absolute=absolute, sampling=sampling)
+
+    # Define kernel (axis-aligned KD-trees are faster for low dimensional data) and build the tree only once
+    kde = KernelDensity(kernel=kernel, bandwidth=bandwidth, algorithm="kd_tree" if data.shape[1] <= 20 else "ball_tree")
+    kde.fit(data)
+
+    # Run kernel density calculation; the fitted estimator is sent once to each worker and about two grid chunks per
+    # process hide load imbalance
+    with multiprocessing.Pool(initializer=_init_kde_worker, initargs=(kde,)) as pool:
+        mp = pool.imap(_mp_kde, _grid_chunks(grid=grid, n_chunks=2 * multiprocessing.cpu_count()))
+        dens = np.concatenate(list(mp))
+
+    # Normalize and return
+    return _kde_normalize(dens=dens, n_data=data.shape[0], norm=norm, absolute=absolute, sampling=sampling)
+
+
+# -----------------------------------------------------------------------------
+def fft_kde(data, axes, bandwidth, kernel="epanechnikov", norm=None, absolute=False, sampling=None):
+    """
+    Kernel density estimation on a regular grid. The data are binned into a histogram on the grid lattice which is
+    then convolved with the discretized kernel via FFT. This is much faster than evaluating the density at each grid
+    point, but positions are only resolved to the grid spacing.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Input data of shape (n_samples, n_dimensions).
+    axes : iterable
+        List of equidistant grid point coordinates for each dimension.
+    bandwidth : int, float
+        Bandwidth of kernel (in data units).
+    kernel : str, optional
+        Name of kernel for KDE. e.g. 'epanechnikov' or 'gaussian'. Default is 'epanechnikov'.
+    norm : str, optional
+        Whether to normalize the result (density estimate from 0 to 1). Default is False.
+    absolute : bool, optional
+        Whether to return absolute numbers.
+    sampling : int, optional
+        Sampling of grid. Necessary only when absolute numbers should be returned.
+
+    Returns
+    -------
+    np.ndarray
+        Density on the grid with shape (len(axes[0]), len(axes[1]), ...).
+
+    """
+
+    # If we want absolute values, we must specify the sampling
+    if absolute:
+        if not sampling:
+            raise ValueError("For absolute values, sampling needs to be specified")
+
+    # Check kernel
+    if kernel not in _kernel_profiles:
+        raise ValueError("Kernel {0:s} not supported".format(kernel))
+
+    # If only one dimension, extend
+    if len(data.shape) == 1:
+        data = data[:, np.newaxis]
+
+    # Dimensions of grid and data must match
+    if len(axes) != data.shape[1]:
+        raise ValueError("Data and Grid dimensions must match")
+
+    # Grid spacing for each axis
+    steps = [a[1] - a[0] for a in axes]
+
+    # Bin data into a histogram where the bins are centered on the grid points
+    edges = [np.append(a - s / 2, a[-1] + s / 2) for a, s in zip(axes, steps)]
+    hist = np.histogramdd(data, bins=edges)[0]
+
+    # Build discretized kernel on the same lattice (truncated to its support or a few bandwidths)
+    trunc = _kernel_truncation[kernel] * bandwidth
+    kaxes = [np.arange(-np.floor(trunc / s), np.floor(trunc / s) + 1) * s for s in steps]
+    u = np.sqrt(np.sum([k ** 2 for k in np.meshgrid(*kaxes, indexing="ij")], axis=0)) / bandwidth
+    kern = _kernel_profiles[kernel](u)
+    kern /= np.sum(kern)
+
+    # Convolve and convert counts to density (FFT can introduce tiny negative values)
+    dens = np.clip(fftconvolve(hist, kern, mode="same"), 0, None) / (data.shape[0] * np.prod(steps))
+
+    # Normalize and return
+    return _kde_normalize(dens=dens, n_data=data.shape[0], norm=norm, absolute=absolute, sampling=sampling)
+
+
+# -----------------------------------------------------------------------------
+def _sparse_epanechnikov_kde(grid, data, bandwidth, max_pairs=2 ** 23):
+    """
+    Sums the (unnormalized) Epanechnikov kernel contributions of all data points for each grid point from the sparse
+    distance matrix of all pairs closer than the bandwidth.
+
+    Parameters
+    ----------
+    grid : np.ndarray
+        Grid on which to evaluate the density with shape (n_grid, n_dimensions).
+    data : np.ndarray
+        Input data with shape (n_data, n_dimensions).
+    bandwidth : int, float
+        Bandwidth of kernel (in data units).
+    max_pairs : int, optional
+        Approximate number of pairs kept in memory at once. Default is 2**23.
+
+    Returns
+    -------
+    np.ndarray
+        Kernel sums for each grid point.
+
+    """
+
+    # Build tree for data and estimate the number of neighbours per grid point from a subsample of the grid
+    tree = cKDTree(data)
+    nnbrs = tree.query_ball_point(grid[::max(1, grid.shape[0] // 1000)], r=bandwidth, return_length=True)
+
+    # Evaluate in chunks of the grid so that the distance matrix stays within the memory budget
+    step = max(1, int(max_pairs // max(2 * np.mean(nnbrs), 1)))
+    dens = np.zeros(grid.shape[0])
+    for i in range(0, grid.shape[0], step):
+        chunk = grid[i:i + step]
+        pairs = cKDTree(chunk).sparse_distance_matrix(tree, max_distance=bandwidth, output_type="ndarray")
+        dens[i:i + step] = np.bincount(pairs["i"], weights=1 - (pairs["v"] / bandwidth) ** 2, minlength=len(chunk))
+
+    return dens
+
+
+# -----------------------------------------------------------------------------
+def _epanechnikov_norm(n_dimensions, bandwidth):
+    """
+    Normalization constant of the Epanechnikov kernel (1 - r^2 / h^2) so that it integrates to unity.
+
+    Parameters
+    ----------
+    n_dimensions : int
+        Number of dimensions.
+    bandwidth : int, float
+        Bandwidth of kernel.
+
+    Returns
+    -------
+    float
+
+    """
 
-    # Define kernel
-    kde = KernelDensity(kernel=kernel, bandwidth=bandwidth)
+    # Volume of the unit n-sphere
+    volume = np.exp(0.5 * n_dimensions * np.log(np.pi) - lgamma(0.5 * n_dimensions + 1))
 
-    # Run kernel density calculation
-    with multiprocessing.Pool() as pool:
-        mp = pool.starmap(_mp_kde, zip(repeat(kde), repeat(data), grid_split))
+    return (n_dimensions + 2) / (2 * volume * bandwidth ** n_dimensions)
+
+
+# -----------------------------------------------------------------------------
+def _kde_normalize(dens, n_data, norm, absolute, sampling):
+    """
+    Applies the normalization options of the KDE routines.
+
+    Parameters
+    ----------
+    dens : np.ndarray
+        Density estimate.
+    n_data : int
+        Number of data points from which the density was estimated.
+    norm : str
+        Normalization method. One of 'max', 'mean', 'sum', or None.
+    absolute : bool
+        Whether to return absolute numbers.
+    sampling : int
+        Sampling of grid.
+
+    Returns
+    -------
+    np.ndarray
 
-    # Create array
-    mp = np.concatenate(mp)
+    """
 
     # If we want absolute numbers we have to evaluate the same thing for the grid
     if absolute:
-        mp *= data.shape[0] / np.sum(mp) * sampling
+        dens *= n_data / np.sum(dens) * sampling
 
     # Normalize if set
     if norm == "max":
-        mp /= np.nanmax(mp)
+        dens /= np.nanmax(dens)
     elif norm == "mean":
-        mp /= np.nanmean(mp)
+        dens /= np.nanmean(dens)
     elif norm == "sum":
-        mp /= np.nansum(mp)
+        dens /= np.nansum(dens)
 
     # Return
-    return mp
+    return dens
+
+
+# -----------------------------------------------------------------------------
+# Fitted KernelDensity instance of a kde worker process
+_KDE = None
 
 
 # -----------------------------------------------------------------------------
-def _mp_kde(kde, data, grid):
+def _init_kde_worker(kde):
     """
-    Parallelisation routine for kernel density estimation.
+    Initializer for kde worker processes.
 
     Parameters
     ----------
     kde
-        KernelDensity instance from scikit learn
-    data
-        Input data
+        Fitted KernelDensity instance from scikit learn.
+
+    """
+
+    global _KDE
+    _KDE = kde
+
+
+# -----------------------------------------------------------------------------
+def _grid_chunks(grid, n_chunks):
+    """
+    Yields contiguous chunks of grid points.
+
+    Parameters
+    ----------
+    grid : np.ndarray
+        Grid with shape (n_grid, n_dimensions).
+    n_chunks : int
+        Number of chunks.
+
+    Returns
+    -------
+    generator
+
+    """
+
+    step = max(1, -(-grid.shape[0] // n_chunks))
+    for i in range(0, grid.shape[0], step):
+        yield grid[i:i + step]
+
+
+# -----------------------------------------------------------------------------
+def _mp_kde(grid):
+    """
+    Parallelisation routine for kernel density estimation with the estimator shared with the worker process.
+
+    Parameters
+    ----------
     grid
         Grid on which to evaluate the density.
 
@@ -99,4 +328,4 @@ def _mp_kde(kde, data, grid):
 
     """
 
-    return np.exp(kde.fit(data).score_samples(grid))
+    return np.exp(_KDE.score_samples(grid))
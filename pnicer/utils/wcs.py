@@ -125,8 +125,8 @@ def data2grid(lon, lat, frame, proj_code="TAN", pixsize=5. / 60, return_skycoord
     # Get WCS
     mywcs = wcs.WCS(header=header)
 
-    # Create image coordinate grid
-    image_grid = np.meshgrid(np.arange(0, header["NAXIS1"], 1), np.arange(0, header["NAXIS2"], 1))
+    # Create image coordinate grid (sparse, the full grid is only built by broadcasting in the transformation)
+    image_grid = np.meshgrid(np.arange(0, header["NAXIS1"], 1), np.arange(0, header["NAXIS2"], 1), sparse=True)
 
     # Convert to world coordinates and get WCS grid for this projection
     world_grid = mywcs.wcs_pix2world(image_grid[0], image_grid[1], 0)
@@ -12,7 +12,7 @@ setup(
     packages=["pnicer", "pnicer.tests", "pnicer.tests_resources", "pnicer.utils"],
     package_dir={"pnicer": "pnicer"},
     package_data={"pnicer": ["tests_resources/*.fits"]},
-    install_requires=["numpy>=1.11", "scipy>=0.18", "scikit-learn>=0.18", "matplotlib>=1.5", "astropy>=1.3"],
+    install_requires=["numpy>=1.11", "scipy>=1.6", "scikit-learn>=0.18", "matplotlib>=1.5", "astropy>=1.3"],
     url="",
     license="",
     author="Stefan Meingast",